@@ -0,0 +1,20 @@
+# gunicorn -c gunicorn.conf.py hci_agent_app:app
+#
+# Threaded workers keep many Gemini calls and section streams in flight at once;
+# each analysis mostly waits on the network, so threads are cheap here.
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "32"))
+# gthread workers heartbeat from their main loop, so this does not bound a request
+# or a section stream; it only has to cover worker boot (post_fork starts the PDF
+# pool and may load the semantic cache's embedding model)
+timeout = 300
+preload_app = True
+
+
+def post_fork(server, worker):
+    from hci_agent_app import init_worker
+    init_worker()
@@ -1,13 +1,32 @@
+import io
 import os
+import re
+import json
+import string
+import time
+import asyncio
+import multiprocessing
+import threading
+import uuid
+import hashlib
 import logging
-from flask import Flask, render_template, request, send_file, jsonify
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from flask import Flask, render_template, request, send_file, jsonify, Response, stream_with_context
 from google import genai
-from PyPDF2 import PdfReader
-import tempfile
+from google.genai import types
+import fitz
+import diskcache
 from fpdf import FPDF
+from fpdf.enums import XPos, YPos
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024  # 20MB max upload size
+MAX_PDF_PAGES = 80
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,7 +36,15 @@ SECTIONS = ["TL;DR", "Analogy", "Worked Example", "Dataset", "Modality",
             "Problem Statement", "Methodology", "Key Findings", 
             "Research Gap", "Future Directions", "What Should You Read Yourself?"]
 
+# Analyses by job id: the inputs until the result page streams them, then the
+# rendered sections (saved as they arrive) for reloads and the PDF download.
+# On disk so every worker process sees them.
+JOB_TTL = 3600  # seconds
+REPLAY_POLL_INTERVAL = 1  # seconds between checks when replaying a running job
+_JOBS = diskcache.Cache("./.jobs")
+
 # --- Setup Gemini client ---
+@lru_cache(maxsize=1)
 def create_gemini_client():
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
@@ -30,20 +57,20 @@ def create_gemini_client():
         logger.error(f"Failed to connect to Gemini API: {str(e)}")
         raise ValueError(f"API connection failed. Please check your API key and network connection: {str(e)}")
 
+# Built on first use in each process (lru_cache) so its HTTP connection pool is
+# reused across requests. A missing key is not cached: each call raises again.
+
 # --- HCI Agent Prompt Template ---
-HCI_PROMPT_TEMPLATE = """
+# Static instructions, identical for every paper
+HCI_ROLE = """
 ROLE
 You are an expert simpliier of HCI researcher: curious, innovation-focused, and great at explaining theory to non-experts without jargon. 
 You must turn dense HCI/theory papers into clear, teachable insights.
 Your goal is to translate dense HCI papers into clear, actionable insights that anyone can understand.
 
-INPUT PAPER
-Title: {title}
-Authors/Year: {authors}
-Abstract (from PDF): {abstract}
-Notes/Audience: {notes}
+"""
 
-MISSION
+HCI_INSTRUCTIONS = """MISSION
 Break down this paper into plain language while maintaining technical accuracy. Assume the reader has basic knowledge of HCI concepts but no specialized jargon.
 So, Produce a concise, structured breakdown that anyone can understand, while thinking like an HCI researcher who hunts for novelty and real-world impact. If information is missing, write "Not reported." Avoid speculation unless explicitly flagged.
 
@@ -54,89 +81,472 @@ OUTPUT RULES
 - If you infer, say "(Inference)" and explain why.
 - Do not invent datasets, numbers, or study details.
 
-TEMPLATE
-0) TL;DR
-   • What the paper is really about + the core contribution in plain English.
+"""
+
+# The only per-paper part of every prompt
+HCI_PAPER_TEMPLATE = """INPUT PAPER
+Title: {title}
+Authors/Year: {authors}
+Abstract (from PDF): {abstract}
+Notes/Audience: {notes}
+
+"""
+
+HCI_PROMPT_PREAMBLE = HCI_ROLE + HCI_PAPER_TEMPLATE + HCI_INSTRUCTIONS
 
-1) Analogy
-   • One vivid everyday analogy that maps the paper's idea to a familiar scenario.
+# One entry per card; each is sent as its own request so sections generate in parallel
+SECTION_TEMPLATES = {
+    "TL;DR": """0) TL;DR
+   • What the paper is really about + the core contribution in plain English.""",
 
-2) Worked Example (Concrete Walk-through)
-   • A short step-by-step user story example showing how the idea or system would be used in practice.
+    "Analogy": """1) Analogy
+   • One vivid everyday analogy that maps the paper's idea to a familiar scenario.""",
 
-3) Dataset
+    "Worked Example": """2) Worked Example (Concrete Walk-through)
+   • A short step-by-step user story example showing how the idea or system would be used in practice.""",
+
+    "Dataset": """3) Dataset
    • Is there a dataset? Yes/No.
    • If Yes: name, size, source, key variables/labels, licensing, collection method, limits/biases ⚠.
-   • If No: say what artifacts they used instead (e.g., formal model, prototype, design probes, simulated data), and how evaluation was done (if any).
+   • If No: say what artifacts they used instead (e.g., formal model, prototype, design probes, simulated data), and how evaluation was done (if any).""",
 
-4) Modality
+    "Modality": """4) Modality
    • Inputs (e.g., touch, speech, gaze, sensors, logs, questionnaires, or any other).
    • Outputs/representations (e.g., visualization, haptics, AR, text or any other).
-   • Context (device/platform/setting).
+   • Context (device/platform/setting).""",
 
-5) Problem Statement
-   • The user/stakeholder problem and why current solutions are insufficient.
+    "Problem Statement": """5) Problem Statement
+   • The user/stakeholder problem and why current solutions are insufficient.""",
 
-6) Methodology
+    "Methodology": """6) Methodology
    • Core approach (theory/model/system/design method).
    • Pipeline or steps (bullet list).
-   • Study/eval (if any): study type, N, tasks/measures, analysis. Mark any under-powered or non-generalizable aspects ⚠.
+   • Study/eval (if any): study type, N, tasks/measures, analysis. Mark any under-powered or non-generalizable aspects ⚠.""",
 
-7) Key Findings
+    "Key Findings": """7) Key Findings
    • 3–6 bullets of the most decision-relevant results/claims.
-   • Include effect sizes/quant where reported; else "qualitative claim" ⚠.
+   • Include effect sizes/quant where reported; else "qualitative claim" ⚠.""",
 
-8) Research Gap Addressed
+    "Research Gap": """8) Research Gap Addressed
    • What gap in prior work this paper targets (be specific).
-   • What gap remains unresolved after this paper ⚠.
+   • What gap remains unresolved after this paper ⚠.""",
 
-9) Future Directions / Scope
+    "Future Directions": """9) Future Directions / Scope
    • Near-term: concrete, feasible next steps (data, tooling, studies).
    • Mid/long-term: visionary directions and dependencies.
-   • Risks/ethical concerns/validity threats ⚠ + how to mitigate.
+   • Risks/ethical concerns/validity threats ⚠ + how to mitigate.""",
 
-10) What Should You Read Yourself?
+    "What Should You Read Yourself?": """10) What Should You Read Yourself?
     • Yes/No + Reason.
     • If Yes: list 2–3 specific sections to read (e.g., "Section 3.2 Formalization," "Appendix B study protocol") and why (e.g., critical proofs, design rationale, subtle limitations).
-    • If No: state why the summary suffices (e.g., purely conceptual, high-level).
+    • If No: state why the summary suffices (e.g., purely conceptual, high-level).""",
+}
+
+QUICK_REFERENCES_TEMPLATE = """11) Quick References
+    • One-line citation (venue/year) and page/figure numbers for any crucial claims, if available."""
 
-11) Quick References
-    • One-line citation (venue/year) and page/figure numbers for any crucial claims, if available.
+SECTION_TASK = """TASK
+Produce ONLY the section below, starting directly with its bullet points.
+Do not repeat the section heading and do not write any other section.
 
 """
 
+# Per-section request tails, joined once here instead of on every request
+_SECTION_PROMPT_TAILS = {section: SECTION_TASK + template for section, template in SECTION_TEMPLATES.items()}
+
+# Full single-request prompt, still used by the Batch API path
+HCI_PROMPT_TEMPLATE = (HCI_PROMPT_PREAMBLE + "TEMPLATE\n"
+                       + "\n\n".join([*SECTION_TEMPLATES.values(), QUICK_REFERENCES_TEMPLATE])
+                       + "\n\n")
+
+# Cached per analysis together with the paper, so section requests only send their task
+HCI_SYSTEM_INSTRUCTION = (HCI_ROLE + HCI_INSTRUCTIONS + "TEMPLATE\n"
+                          + "\n\n".join(SECTION_TEMPLATES.values()) + "\n")
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+# Form choice -> Gemini service tier (priority: lowest latency, flex: ~50% cheaper)
+SERVICE_TIERS = {"fast": "priority", "balanced": "standard", "cheap": "flex"}
+
+# Input budget for the extracted paper text; this, not page count, bounds cost and TTFT
+MAX_ABSTRACT_TOKENS = 4000
+CHARS_PER_TOKEN = 3.5  # fallback estimate when count_tokens is unavailable
+
+# Short papers are sent to Gemini as the PDF itself, which keeps layout and works on
+# scans; Gemini bills ~258 tokens per page, so this stays within the same budget
+TOKENS_PER_PDF_PAGE = 258
+NATIVE_PDF_MAX_PAGES = MAX_ABSTRACT_TOKENS // TOKENS_PER_PDF_PAGE
+
+# Each analysis caches its instructions + paper once and all section requests reuse
+# it. Gemini rejects explicit caches under its minimum size (1024 tokens on 2.5 Flash).
+ANALYSIS_CACHE_TTL = 600  # seconds; outlives one analysis, deleted when it finishes
+MIN_CACHE_TOKENS = 1024
+
+# Bump whenever the prompts change so cached summaries are invalidated
+PROMPT_VERSION = "v4"
+SUMMARY_CACHE_TTL = 30 * 86400  # 30 days
+
+_SUMMARY_CACHE = diskcache.Cache("./.gemini_cache")
+
+# --- Optional semantic cache for near-duplicate papers ---
+@lru_cache(maxsize=1)
+def create_semantic_cache():
+    # Needs redisvl and a Redis Stack server; the app runs without it
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return None
+    
+    try:
+        from redisvl.extensions.cache.llm import SemanticCache
+        from redisvl.utils.vectorize import HFTextVectorizer
+        return SemanticCache(
+            name=f"hci_llmcache_{PROMPT_VERSION}",
+            redis_url=redis_url,
+            distance_threshold=0.1,
+            ttl=SUMMARY_CACHE_TTL,
+            vectorizer=HFTextVectorizer("redis/langcache-embed-v1")
+        )
+    except Exception as e:
+        logger.warning(f"Semantic cache disabled: {str(e)}")
+        return None
+
+# Submitted Gemini batch jobs, keyed by batch name
+BATCH_DB_PATH = "./batch_jobs.db"
+
+def init_batch_db():
+    with closing(sqlite3.connect(BATCH_DB_PATH)) as conn, conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS batch_jobs (
+                            name TEXT PRIMARY KEY,
+                            created_at TEXT NOT NULL,
+                            papers TEXT NOT NULL)""")
+
+init_batch_db()
+
+# PDF parsing is CPU-bound, so it runs in worker processes off the request path.
+# They come from a forkserver that has already imported this module, never from
+# the threaded server itself: forking it could copy a held lock into a child and
+# hang it. That makes starting (or replacing) the pool safe from any request.
+_PDF_POOL_CONTEXT = multiprocessing.get_context("forkserver")
+_PDF_POOL_CONTEXT.set_forkserver_preload(["__main__", __name__])
+_PDF_POOL = None
+_PDF_POOL_LOCK = threading.Lock()
+
+def start_pdf_pool():
+    pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=_PDF_POOL_CONTEXT)
+    pool.submit(int).result()
+    return pool
+
+def get_pdf_pool():
+    # Started on first use in each process
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is None:
+            _PDF_POOL = start_pdf_pool()
+        return _PDF_POOL
+
+def replace_pdf_pool(broken):
+    # Swap in a fresh pool unless another request already replaced this one
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is broken:
+            _PDF_POOL = start_pdf_pool()
+    broken.shutdown(wait=False)
+
+def extract_in_pool(pdf_bytes, max_pages=None):
+    # A crashed worker (MuPDF segfault or OOM on a malformed PDF) breaks the whole
+    # pool and fails every job in it, so each job is retried once on a fresh pool;
+    # only a PDF that crashes that one too raises BrokenProcessPool
+    for retry in (False, True):
+        pool = get_pdf_pool()
+        try:
+            return pool.submit(extract_pdf_text, pdf_bytes, max_pages).result()
+        except BrokenProcessPool:
+            logger.error("PDF worker process crashed; restarting the pool")
+            replace_pdf_pool(pool)
+            if retry:
+                raise
+
 # --- Extract text from PDF ---
-def extract_pdf_text(pdf_path, max_pages=5):
+def extract_pdf_text(pdf_bytes, max_pages=None):
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for i, page in enumerate(reader.pages):
-            if i >= max_pages:
-                break
-            text += page.extract_text() + "\n"
+        # PyMuPDF keeps reading order on two-column layouts and is much faster than PyPDF2
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            page_count = doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+            text = "\n".join(
+                doc[i].get_text("text", flags=fitz.TEXT_PRESERVE_WHITESPACE)
+                for i in range(page_count)
+            )
+        finally:
+            doc.close()
         return text if text.strip() else "⚠ No text extracted from PDF"
     except Exception as e:
         logger.error(f"PDF extraction failed: {str(e)}")
         return f"⚠ Failed to extract text from PDF: {str(e)}"
 
-# --- Generate summary via Gemini ---
-def analyze_paper(title, authors, abstract, notes, model="gemini-2.5-flash"):
+def pdf_page_count(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return doc.page_count
+
+# --- Reject junk uploads before doing any work ---
+def validate_pdf(filename, pdf_bytes):
+    # Returns (page_count, error message or None)
+    # The raw name is checked: secure_filename would strip non-ASCII names like "论文.pdf"
+    if os.path.splitext(filename)[1].lower() != ".pdf" or not pdf_bytes.startswith(b"%PDF-"):
+        return 0, "The uploaded file is not a PDF"
     try:
-        client = create_gemini_client()
-        prompt = HCI_PROMPT_TEMPLATE.format(
-            title=title or "Not provided",
-            authors=authors or "Not provided",
-            abstract=abstract or "Not provided",
-            notes=notes or "Not provided"
-        )
-        response = client.models.generate_content(
+        page_count = pdf_page_count(pdf_bytes)
+    except Exception as e:
+        logger.warning(f"Could not open uploaded PDF: {str(e)}")
+        page_count = 0
+    if page_count == 0:
+        return 0, "The PDF could not be read or has no pages"
+    if page_count > MAX_PDF_PAGES:
+        return page_count, f"The PDF has {page_count} pages; the maximum is {MAX_PDF_PAGES}"
+    return page_count, None
+
+# --- Cap the extracted text by tokens rather than pages ---
+def truncate_to_token_budget(client, text, model=DEFAULT_MODEL, budget=MAX_ABSTRACT_TOKENS):
+    # Keeps the opening 70% of the budget (abstract/intro) and the closing 30% (conclusions)
+    if len(text) <= budget:
+        return text
+    try:
+        tokens = client.models.count_tokens(model=model, contents=text).total_tokens
+    except Exception as e:
+        logger.warning(f"Token count failed, estimating instead: {str(e)}")
+        tokens = len(text) / CHARS_PER_TOKEN
+    if tokens <= budget:
+        return text
+    
+    chars_per_token = len(text) / tokens
+    head = int(budget * 0.7 * chars_per_token)
+    tail = int(budget * 0.3 * chars_per_token)
+    logger.info(f"Truncated paper text from {int(tokens)} to ~{budget} tokens")
+    return text[:head] + "\n[...]\n" + text[-tail:]
+
+# --- Build the Gemini prompts for one paper ---
+def compile_prompt_template(template):
+    # Splits the template into (literal, field) pairs once at import, so building a
+    # prompt is a single join rather than a format-string scan on every request
+    parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+    
+    def build(**values):
+        return "".join(literal + (values[field] if field else "") for literal, field in parts)
+    return build
+
+_build_full_prompt = compile_prompt_template(HCI_PROMPT_TEMPLATE)
+_build_preamble = compile_prompt_template(HCI_PROMPT_PREAMBLE)
+_build_paper_block = compile_prompt_template(HCI_PAPER_TEMPLATE)
+
+def paper_fields(title, authors, abstract, notes):
+    return {
+        "title": title or "Not provided",
+        "authors": authors or "Not provided",
+        "abstract": abstract or "Not provided",
+        "notes": notes or "Not provided"
+    }
+
+def build_prompt(title, authors, abstract, notes):
+    return _build_full_prompt(**paper_fields(title, authors, abstract, notes))
+
+def build_section_prompt(section, title, authors, abstract, notes):
+    preamble = _build_preamble(**paper_fields(title, authors, abstract, notes))
+    return preamble + _SECTION_PROMPT_TAILS[section]
+
+# --- Cache one paper's instructions and content for its section requests ---
+def create_analysis_cache(client, model, paper_contents):
+    # Returns the cached content name, or None to send full prompts instead
+    try:
+        cache = client.caches.create(
             model=model,
-            contents=prompt
+            config={
+                "display_name": f"hci-analysis-{PROMPT_VERSION}",
+                "system_instruction": HCI_SYSTEM_INSTRUCTION,
+                "contents": paper_contents,
+                "ttl": f"{ANALYSIS_CACHE_TTL}s"
+            }
         )
-        return response.text
+        return cache.name
+    except Exception as e:
+        logger.warning(f"Context caching unavailable, sending full prompts: {str(e)}")
+        return None
+
+def delete_analysis_cache(client, cache_name):
+    try:
+        client.caches.delete(name=cache_name)
+    except Exception as e:
+        logger.warning(f"Could not delete cached content {cache_name}: {str(e)}")
+
+def delete_uploaded_pdf(client, file_name):
+    try:
+        client.files.delete(name=file_name)
+    except Exception as e:
+        logger.warning(f"Could not delete uploaded file {file_name}: {str(e)}")
+
+# --- Generate one section via Gemini ---
+def analyze_section(client, contents, model=DEFAULT_MODEL, service_tier="standard", cache_name=None):
+    config = {}
+    if service_tier != "standard":
+        config["service_tier"] = service_tier
+    if cache_name:
+        config["cached_content"] = cache_name
+    response = client.models.generate_content(
+        model=model,
+        contents=contents,
+        config=config or None
+    )
+    return response.text
+
+# --- Generate all sections concurrently ---
+def analyze_paper(title, authors, abstract, notes, model=DEFAULT_MODEL, service_tier="standard",
+                  pdf_bytes=None):
+    # Yields (section, content) in completion order, so wall time is the slowest
+    # section; content is the exception for a section whose request failed.
+    # When pdf_bytes is given the PDF itself is sent instead of the extracted text.
+    client = create_gemini_client()
+    pdf_part = None
+    pdf_file = None
+    if pdf_bytes is not None:
+        # Uploaded once and referenced by URI: inline data is capped at 20MB per
+        # request and would otherwise be resent with every section
+        pdf_file = client.files.upload(file=io.BytesIO(pdf_bytes), config={"mime_type": "application/pdf"})
+        pdf_part = types.Part.from_uri(file_uri=pdf_file.uri, mime_type=pdf_file.mime_type)
+        abstract = "See the attached PDF."
+    else:
+        abstract = truncate_to_token_budget(client, abstract or "", model)
+    
+    paper_block = _build_paper_block(**paper_fields(title, authors, abstract, notes))
+    paper_contents = [pdf_part, paper_block] if pdf_part is not None else [paper_block]
+    # Text-only papers may be too short to cache; a PDF is always over the minimum
+    estimated_tokens = (len(HCI_SYSTEM_INSTRUCTION) + len(paper_block)) / CHARS_PER_TOKEN
+    cache_name = None
+    if pdf_part is not None or estimated_tokens >= MIN_CACHE_TOKENS:
+        cache_name = create_analysis_cache(client, model, paper_contents)
+    
+    def section_contents(section):
+        if cache_name:
+            return _SECTION_PROMPT_TAILS[section]
+        prompt = build_section_prompt(section, title, authors, abstract, notes)
+        return [pdf_part, prompt] if pdf_part is not None else prompt
+    
+    try:
+        with ThreadPoolExecutor(max_workers=len(SECTIONS)) as pool:
+            futures = {
+                pool.submit(analyze_section, client, section_contents(section), model=model,
+                            service_tier=service_tier, cache_name=cache_name): section
+                for section in SECTIONS
+            }
+            for future in as_completed(futures):
+                section = futures[future]
+                try:
+                    yield section, future.result()
+                except Exception as e:
+                    logger.error(f"Analysis of section {section} failed: {str(e)}")
+                    yield section, e
+    finally:
+        if cache_name:
+            delete_analysis_cache(client, cache_name)
+        if pdf_file is not None:
+            delete_uploaded_pdf(client, pdf_file.name)
+
+# --- Serve repeat submissions from the on-disk summary cache ---
+def summary_cache_key(pdf_bytes, title, authors, notes):
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(PROMPT_VERSION.encode())
+    digest.update("\0".join([title, authors, notes]).encode())
+    return digest.hexdigest()
+
+def semantic_cache_lookup(probe):
+    scache = create_semantic_cache()
+    if scache is None:
+        return None
+    try:
+        hits = scache.check(prompt=probe)
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed: {str(e)}")
+        return None
+    return hits[0]["response"] if hits else None
+
+def semantic_cache_store(probe, summary):
+    scache = create_semantic_cache()
+    if scache is None:
+        return
+    try:
+        scache.store(prompt=probe, response=summary)
     except Exception as e:
-        logger.error(f"Analysis failed: {str(e)}")
-        raise ValueError(f"Analysis failed: {str(e)}")
+        logger.warning(f"Semantic cache store failed: {str(e)}")
+
+def cached_analysis(cache_key, title, authors, abstract, notes, service_tier="standard", pdf_bytes=None):
+    # Yields (section, content) pairs from the caches, or from Gemini on a miss
+    cached = _SUMMARY_CACHE.get(cache_key)
+    if cached is not None:
+        logger.info(f"Summary cache hit for {cache_key[:12]}")
+        yield from cached.items()
+        return
+    
+    # Near-duplicates (edited title, re-uploaded preprint) match on the opening text
+    probe = f"{title}\n{notes}\n{(abstract or '')[:4000]}"
+    cached = semantic_cache_lookup(probe)
+    if cached is not None:
+        logger.info(f"Semantic cache hit for {cache_key[:12]}")
+        sections_data = json.loads(cached)
+        _SUMMARY_CACHE.set(cache_key, sections_data, expire=SUMMARY_CACHE_TTL)
+        yield from sections_data.items()
+        return
+    
+    sections_data = {}
+    for section, content in analyze_paper(title, authors, abstract, notes,
+                                          service_tier=service_tier, pdf_bytes=pdf_bytes):
+        sections_data[section] = content
+        yield section, content
+    # Only cache complete analyses
+    if all(isinstance(content, str) for content in sections_data.values()):
+        _SUMMARY_CACHE.set(cache_key, sections_data, expire=SUMMARY_CACHE_TTL)
+        semantic_cache_store(probe, json.dumps(sections_data))
+
+# --- Split a single-request Gemini summary into sections ---
+# A numbered heading line, optionally wrapped in markdown (e.g. "**3) Dataset**",
+# "## 3) Dataset" or "3) **Dataset**")
+_SECTION_RE = re.compile(r"(?m)^[#*\s]*(\d{1,2})\)\s+([^\n]+)$")
+
+def split_sections(full_summary):
+    # One regex pass; content is None for sections Gemini never produced
+    headings = []
+    for match in _SECTION_RE.finditer(full_summary):
+        number = int(match.group(1))
+        # Numbered list items inside a section must not end it; trailing
+        # headings such as "11) Quick References" still do
+        name = match.group(2).strip("#* \t")
+        if number >= len(SECTIONS) or name.startswith(SECTIONS[number]):
+            headings.append(match)
+    
+    sections_data = dict.fromkeys(SECTIONS)
+    for match, following in zip(headings, headings[1:] + [None]):
+        number = int(match.group(1))
+        if number >= len(SECTIONS) or sections_data[SECTIONS[number]] is not None:
+            continue
+        end = following.start() if following else len(full_summary)
+        sections_data[SECTIONS[number]] = full_summary[match.end():end].strip()
+    return sections_data
+
+def render_section(content):
+    if content is None:
+        return "⚠ Section not found in analysis"
+    if isinstance(content, Exception):
+        return f"⚠ This section could not be generated: {str(content)}"
+    return format_section_content(content)
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(stream_with_context(events),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Numbered heading prefixes "0)" .. "11)", built once rather than per line
+_HEADING_PREFIXES = tuple(f"{i})" for i in range(12))
 
 # --- Format section content for better readability ---
 def format_section_content(content):
@@ -150,7 +560,7 @@ def format_section_content(content):
         line = line.strip()
         if line.startswith("•") or line.startswith("-"):
             formatted_lines.append(f'<li>{line[1:].strip()}</li>')
-        elif line and any(line.startswith(str(i)+")") for i in range(12)):
+        elif line.startswith(_HEADING_PREFIXES):
             formatted_lines.append(f'<h4>{line}</h4>')
         elif line:
             formatted_lines.append(f'<p>{line}</p>')
@@ -159,7 +569,7 @@ def format_section_content(content):
 
 # --- Routes ---
 @app.route("/", methods=["GET", "POST"])
-def index():
+async def index():
     if request.method == "POST":
         if "pdf_file" not in request.files or request.files["pdf_file"].filename == "":
             return render_template("index.html", error="⚠ PDF file is required")
@@ -168,41 +578,54 @@ def index():
         title = request.form.get("title", "").strip()
         authors = request.form.get("authors", "").strip()
         notes = request.form.get("notes", "").strip()
+        service_tier = SERVICE_TIERS.get(request.form.get("service_tier"), "priority")
         
         if not title:
             return render_template("index.html", error="⚠ Paper title is required")
         
-        # Save PDF temporarily
+        # Work on the upload in memory; nothing is written to disk
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                pdf_file.save(tmp.name)
-                pdf_path = tmp.name
+            pdf_bytes = pdf_file.read()
             
-            # Extract PDF text
-            extracted_text = extract_pdf_text(pdf_path)
+            page_count, error = validate_pdf(pdf_file.filename, pdf_bytes)
+            if error:
+                return render_template("index.html", error=f"⚠ {error}")
             
-            # Generate Gemini summary
-            full_summary = analyze_paper(title, authors, extracted_text, notes)
+            # Short papers go to Gemini as the PDF itself, so only their first page
+            # is parsed (for the semantic cache probe)
+            native_pdf = page_count <= NATIVE_PDF_MAX_PAGES
             
-            # Split Gemini response by sections
-            sections_data = {}
-            for idx, section in enumerate(SECTIONS):
-                marker = f"{idx}) {section}"
-                next_marker = f"{idx+1})" if idx+1 < len(SECTIONS) else None
-                start = full_summary.find(marker)
-                if start == -1:
-                    sections_data[section] = "⚠ Section not found in analysis"
-                    continue
-                    
-                end = full_summary.find(next_marker) if next_marker else len(full_summary)
-                content = full_summary[start+len(marker):end].strip()
-                sections_data[section] = format_section_content(content)
+            # Parse in a worker process while hashing for the cache key here
+            try:
+                extracted_text, cache_key = await asyncio.gather(
+                    asyncio.to_thread(extract_in_pool, pdf_bytes, 1 if native_pdf else None),
+                    asyncio.to_thread(summary_cache_key, pdf_bytes, title, authors, notes)
+                )
+            except BrokenProcessPool:
+                return render_template("index.html", error="⚠ The PDF could not be processed. It may be damaged.")
+            
+            # Hand the analysis to the event stream opened by the result page
+            job_id = uuid.uuid4().hex
+            _JOBS.set(job_id, {
+                "title": title,
+                "sections": {},
+                "analysis": {
+                    "cache_key": cache_key,
+                    "title": title,
+                    "authors": authors,
+                    "abstract": extracted_text,
+                    "notes": notes,
+                    "service_tier": service_tier,
+                    "pdf_bytes": pdf_bytes if native_pdf else None
+                }
+            }, expire=JOB_TTL)
             
             return render_template("result.html", 
                                   sections=SECTIONS, 
-                                  results=sections_data, 
+                                  results={}, 
                                   title=title,
-                                  authors=authors)
+                                  authors=authors,
+                                  job_id=job_id)
             
         except Exception as e:
             logger.exception("Processing error")
@@ -211,55 +634,268 @@ def index():
     
     return render_template("index.html")
 
+# --- Stream analysis sections as server-sent events ---
+@app.route("/stream/<job_id>")
+def stream_analysis(job_id):
+    # Claim the job's inputs so each analysis is only run once
+    with _JOBS.transact():
+        job = _JOBS.get(job_id)
+        analysis = job.pop("analysis", None) if job else None
+        if analysis is not None:
+            _JOBS.set(job_id, job, expire=JOB_TTL)
+    if job is None:
+        return jsonify(error="Unknown or expired analysis"), 404
+    if analysis is None:
+        # Already claimed, e.g. the result page was reloaded
+        return sse_response(replay_sections(job_id))
+    
+    def generate():
+        try:
+            failures = []
+            for section, content in cached_analysis(**analysis):
+                if isinstance(content, Exception):
+                    failures.append(content)
+                html = render_section(content)
+                job["sections"][section] = html
+                # Saved as it arrives so downloads and reloads see it
+                _JOBS.set(job_id, job, expire=JOB_TTL)
+                yield sse_event({"section": section, "html": html})
+            if len(failures) == len(SECTIONS):
+                job["error"] = f"⚠ Analysis failed: {str(failures[0])}"
+                yield sse_event({"error": job["error"]}, event="analysis_error")
+        except Exception as e:
+            logger.exception("Streaming error")
+            job["error"] = f"⚠ Analysis failed: {str(e)}"
+            yield sse_event({"error": job["error"]}, event="analysis_error")
+        finally:
+            job["finished"] = True
+            _JOBS.set(job_id, job, expire=JOB_TTL)
+        yield sse_event({}, event="done")
+    
+    return sse_response(generate())
+
+def replay_sections(job_id):
+    # Sends the stored sections, following the job until its analysis finishes
+    sent = set()
+    while True:
+        job = _JOBS.get(job_id)
+        if job is None:
+            break
+        for section, html in job["sections"].items():
+            if section not in sent:
+                sent.add(section)
+                yield sse_event({"section": section, "html": html})
+        if job.get("finished"):
+            if job.get("error"):
+                yield sse_event({"error": job["error"]}, event="analysis_error")
+            break
+        time.sleep(REPLAY_POLL_INTERVAL)
+    yield sse_event({}, event="done")
+
+# --- Bulk analysis through the Gemini Batch API (cheaper, up to 24h turnaround) ---
+# File sources ("files/...") and dest.file_name on API-key clients need google-genai >= 1.75
+@app.route("/batch_analyze", methods=["POST"])
+def batch_analyze():
+    pdf_files = [f for f in request.files.getlist("pdf_files") if f.filename]
+    if not pdf_files:
+        return jsonify(error="At least one PDF file is required"), 400
+    
+    authors = request.form.get("authors", "").strip()
+    notes = request.form.get("notes", "").strip()
+    
+    try:
+        papers = {}
+        pdfs = {}
+        for pdf_file in pdf_files:
+            pdf_bytes = pdf_file.read()
+            _, error = validate_pdf(pdf_file.filename, pdf_bytes)
+            if error:
+                return jsonify(error=f"{pdf_file.filename}: {error}"), 400
+            key = hashlib.sha1(pdf_bytes).hexdigest()
+            papers[key] = os.path.splitext(pdf_file.filename)[0]
+            pdfs[key] = pdf_bytes
+        
+        # One extraction per worker process
+        def extract_or_none(pdf_bytes):
+            try:
+                return extract_in_pool(pdf_bytes)
+            except BrokenProcessPool:
+                return None
+        
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as threads:
+            texts = list(threads.map(extract_or_none, pdfs.values()))
+        crashed = [papers[key] for key, text in zip(pdfs, texts) if text is None]
+        if crashed:
+            return jsonify(error=f"{', '.join(crashed)}: The PDF could not be processed"), 400
+        
+        client = create_gemini_client()
+        lines = []
+        for (key, title), text in zip(papers.items(), texts):
+            text = truncate_to_token_budget(client, text)
+            prompt = build_prompt(title, authors, text, notes)
+            lines.append(json.dumps({
+                "key": key,
+                "request": {"contents": [{"parts": [{"text": prompt}]}]}
+            }))
+        
+        uploaded = client.files.upload(
+            file=io.BytesIO("\n".join(lines).encode("utf-8")),
+            config={"display_name": "hci-batch-requests", "mime_type": "jsonl"}
+        )
+        batch_job = client.batches.create(
+            model=DEFAULT_MODEL,
+            src=uploaded.name,
+            config={"display_name": f"hci-batch-{len(papers)}-papers"}
+        )
+        
+        with closing(sqlite3.connect(BATCH_DB_PATH)) as conn, conn:
+            conn.execute("INSERT INTO batch_jobs (name, created_at, papers) VALUES (?, ?, ?)",
+                         (batch_job.name, datetime.now().isoformat(), json.dumps(papers)))
+        
+        return jsonify(job=batch_job.name, papers=papers), 202
+    
+    except Exception as e:
+        logger.exception("Batch submission error")
+        return jsonify(error=f"Batch submission failed: {str(e)}"), 500
+
+@app.route("/batch_status/<path:job>")
+def batch_status(job):
+    with closing(sqlite3.connect(BATCH_DB_PATH)) as conn:
+        row = conn.execute("SELECT papers FROM batch_jobs WHERE name = ?", (job,)).fetchone()
+    if row is None:
+        return jsonify(error="Unknown batch job"), 404
+    papers = json.loads(row[0])
+    
+    try:
+        client = create_gemini_client()
+        batch_job = client.batches.get(name=job)
+        state = batch_job.state.name
+        if state != "JOB_STATE_SUCCEEDED":
+            return jsonify(job=job, state=state)
+        
+        if batch_job.dest is None or not batch_job.dest.file_name:
+            return jsonify(error="Batch job finished without a results file", job=job, state=state), 502
+        
+        results = {}
+        output = client.files.download(file=batch_job.dest.file_name).decode("utf-8")
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            key = item.get("key")
+            entry = {"title": papers.get(key, key)}
+            if "response" in item:
+                parts = item["response"]["candidates"][0]["content"]["parts"]
+                summary = "".join(part.get("text", "") for part in parts)
+                entry["results"] = {section: render_section(content)
+                                    for section, content in split_sections(summary).items()}
+            else:
+                entry["error"] = item.get("error")
+            results[key] = entry
+        
+        return jsonify(job=job, state=state, papers=results)
+    
+    except Exception as e:
+        logger.exception("Batch status error")
+        return jsonify(error=f"Batch status check failed: {str(e)}"), 500
+
+# --- PDF report font ---
+# DejaVu covers ⚠ and non-Latin author names; core Helvetica (latin-1 only) is the fallback
+PDF_FONT_DIR = os.getenv("PDF_FONT_DIR", "/usr/share/fonts/truetype/dejavu")
+PDF_FONT_FILES = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf"}
+# Optional: fonts-dejavu-core ships no oblique, so italic falls back to the regular face
+PDF_FONT_ITALIC = "DejaVuSans-Oblique.ttf"
+
+def setup_pdf_font(pdf):
+    # Returns True when the Unicode font was registered
+    paths = {style: os.path.join(PDF_FONT_DIR, name) for style, name in PDF_FONT_FILES.items()}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return False
+    italic = os.path.join(PDF_FONT_DIR, PDF_FONT_ITALIC)
+    paths["I"] = italic if os.path.exists(italic) else paths[""]
+    for style, path in paths.items():
+        pdf.add_font("DejaVu", style, path)
+    return True
+
 # --- Download PDF route ---
-@app.route("/download_pdf/<title>")
-def download_pdf(title):
+@app.route("/download_pdf/<job_id>")
+def download_pdf(job_id):
+    job = _JOBS.get(job_id)
+    if job is None:
+        return render_template("index.html",
+                               error="⚠ This analysis has expired. Please analyze the paper again."), 404
+    
+    if not job.get("finished"):
+        return render_template("index.html",
+                               error="⚠ This analysis is still generating. Download it once every section is ready."), 409
+    
     # Create safe filename
-    safe_title = "".join(c for c in title if c.isalnum() or c in " _-")
-    pdf_file = f"{safe_title}.pdf"
+    safe_title = "".join(c for c in job["title"] if c.isalnum() or c in " _-")
     
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
     
+    unicode_font = setup_pdf_font(pdf)
+    family = "DejaVu" if unicode_font else "Helvetica"
+    
+    def pdf_text(text):
+        return text if unicode_font else text.encode("latin-1", "replace").decode("latin-1")
+    
     # Set up professional styling
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(0, 10, "HCI Paper Analysis Report", ln=True, align='C')
+    pdf.set_font(family, 'B', 16)
+    pdf.cell(0, 10, "HCI Paper Analysis Report", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
     pdf.ln(5)
     
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 8, safe_title, ln=True, align='C')
+    pdf.set_font(family, 'B', 14)
+    pdf.cell(0, 8, pdf_text(safe_title), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
     pdf.ln(10)
     
-    pdf.set_font("Arial", '', 12)
-    
     # Add metadata
-    pdf.set_font("", "I")
-    pdf.cell(0, 6, "Generated by HCI Paper Analyzer", ln=True)
-    pdf.cell(0, 6, f"Date: {datetime.now().strftime('%Y-%m-%d')}", ln=True)
+    pdf.set_font(family, 'I', 12)
+    pdf.cell(0, 6, "Generated by HCI Paper Analyzer", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.cell(0, 6, f"Date: {datetime.now().strftime('%Y-%m-%d')}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(10)
-    pdf.set_font("", "")
     
     # Add content
     for section in SECTIONS:
-        pdf.set_font("", "B")
-        pdf.cell(0, 8, section, ln=True)
-        pdf.set_font("", "")
+        pdf.set_font(family, 'B', 12)
+        pdf.cell(0, 8, pdf_text(section), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.set_font(family, '', 12)
         
         # Get content and clean it for PDF
-        content = request.args.get(section, "")
+        content = job["sections"].get(section, "")
         # Remove HTML tags for PDF
         clean_content = re.sub('<[^<]+?>', '', content)
-        pdf.multi_cell(0, 6, clean_content)
+        pdf.multi_cell(0, 6, pdf_text(clean_content))
         pdf.ln(5)
     
-    pdf.output(pdf_file)
-    return send_file(pdf_file, as_attachment=True, download_name=f"{safe_title}_analysis.pdf")
+    # Build the file in memory: no disk round-trip and no clashes between same-titled reports
+    buffer = io.BytesIO(pdf.output())
+    return send_file(buffer, mimetype="application/pdf", as_attachment=True,
+                     download_name=f"{safe_title}_analysis.pdf")
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
     return render_template("index.html", 
                           error="⚠ File too large. Maximum upload size is 20MB."), 413
 
+# --- Per-process resources ---
+def init_worker():
+    # Called from gunicorn's post_fork hook (gunicorn.conf.py preloads the app).
+    # The client, semantic cache and PDF pool are never built at import, so the
+    # master holds none to share; each worker drops the master's sqlite handles
+    # and builds its own resources now rather than on its first request.
+    # diskcache reconnects lazily after close()
+    _SUMMARY_CACHE.close()
+    _JOBS.close()
+    get_pdf_pool()
+    try:
+        create_gemini_client()
+    except ValueError:
+        pass
+    create_semantic_cache()
+
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Development server only; run under gunicorn in production (see README)
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1", threaded=True, port=5000)
\ No newline at end of file